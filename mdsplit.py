@@ -7,11 +7,17 @@ These files are written to subdirectories representing the document's structure.
 Optionally you can create:
 - table of contents (toc.md) for each input file
 - navigation footers (links to table of contents, previous page, next page)
+- rewritten links, i.e. links to headings (e.g. '#some-heading' or 'other.md#some-heading')
+  are changed to point to the chapter files the headings were written to
+  (inline links and reference definitions, but not inside code blocks or code spans)
 
 Note:
 - Code blocks (```) are detected (and headers inside ignored)
+- Both ATX headings ('# Heading') and Setext headings (underlined with '===' or '---')
+  are supported
+- The closing '---' of YAML front matter is not mistaken for a Setext underline
 - The output is guaranteed to be identical with the input
-  (except for the separation into multiple files of course)
+  (except for the separation into multiple files and rewritten links of course)
     - This means: no touching of whitespace or changing - to * of your lists
       like some viusual Markdown editors tend to do
 - Text before the first heading is written to a file with the same name as the Markdown file
@@ -21,10 +27,10 @@ Note:
   e.g. a 1 GB file is split into 30k files in 35 seconds on a 2015 Thinkpad (with an SSD)
 
 Limitations:
-- Only [ATX headings](https://spec.commonmark.org/0.31.2/#atx-headings)
-  such as '# Heading 1' are supported.
-  [Setext headings](https://spec.commonmark.org/0.31.2/#setext-headings)
-  (underlined headings) are not recognised.
+- [Setext headings](https://spec.commonmark.org/0.31.2/#setext-headings)
+  inside block quotes or list items are not recognised.
+- In a file starting with '---' (e.g. YAML front matter)
+  Setext headings are not recognised until the next '---' or '...' line.
 """
 
 from abc import ABC, abstractmethod
@@ -33,25 +39,42 @@ from dataclasses import dataclass
 from pathlib import Path
 import argparse
 import os
+import posixpath
 import re
 import sys
 
-FENCES = ["```", "~~~"]
+FENCES = ("```", "~~~")
 MAX_HEADING_LEVEL = 6
 DIR_SUFFIX = "_split"
+FRONT_MATTER_START = "---"
+FRONT_MATTER_ENDS = ("---", "...")
+ATX_HEADING = re.compile(r"[ ]{0,3}(#+)(.*)")
+SETEXT_UNDERLINE_CHARS = frozenset(" =-")
+SETEXT_UNDERLINE = re.compile(r"[ ]{0,3}(=|-)\1*[ \t]*$")
+# thematic break, block quote, HTML block or list item (with its content)
+BLOCK_START_CHARS = frozenset(" -*_><+0123456789")
+BLOCK_START = re.compile(
+    r"[ ]{0,3}(?:(([-*_])[ \t]*(?:\2[ \t]*){2,}$)|([><])|([-+*]|\d{1,9}[.)])(\s.*|$))"
+)
+# inline link destination (code spans are matched to be skipped)
+LINK_DESTINATION = re.compile(r"(`+).*?(?<!`)\1(?!`)|\]\((<[^>\n]*>|[^\s)]*)")
+REFERENCE_DEFINITION = re.compile(r"([ ]{0,3}\[[^\]]+\]:[ \t]*)(<[^>\n]*>|\S+)")
 
 Chapter = namedtuple("Chapter", "parent_headings, heading, text")
+Heading = namedtuple("Heading", "heading_level, heading_title")
 
 
 class Splitter(ABC):
-    def __init__(self, encoding, level, toc, navigation, force, verbose):
+    def __init__(self, encoding, level, toc, navigation, force, verbose, rewrite_links=False):
         self.encoding = encoding
         self.level = level
         self.toc = toc
         self.navigation = navigation
+        self.rewrite_links = rewrite_links
         self.force = force
         self.verbose = verbose
         self.stats = Stats()
+        self.anchor_index = AnchorIndex()
 
     @abstractmethod
     def process(self):
@@ -61,6 +84,22 @@ class Splitter(ABC):
     def print_stats(self):
         pass
 
+    def index_stream(self, in_stream, fallback_out_file_name, out_path):
+        """Add all headings of a stream to the anchor index (required for rewriting links)"""
+        if self.verbose:
+            print(f"Index headings for '{out_path}'")
+
+        doc = self.get_doc_name(fallback_out_file_name, out_path)
+        # split at all levels to see all headings, but map each of them
+        # to the chapter (at the split level) it is written to
+        chapter_path = (out_path / fallback_out_file_name).relative_to(self.out_path)
+        for chapter in split_by_heading(in_stream, MAX_HEADING_LEVEL):
+            heading = chapter.heading
+            if heading is not None and heading.heading_level <= self.level:
+                chapter_path = out_path / self.get_chapter_path(chapter, fallback_out_file_name)
+                chapter_path = chapter_path.relative_to(self.out_path)
+            self.anchor_index.add_chapter(doc, heading, chapter_path)
+
     def process_stream(self, in_stream, fallback_out_file_name, out_path):
         if self.verbose:
             print(f"Create output folder '{out_path}'")
@@ -69,20 +108,12 @@ class Splitter(ABC):
         self.stats.in_files += 1
         chapters = split_by_heading(in_stream, self.level)
         nav_chapter_path2title = {}
+        doc = self.get_doc_name(fallback_out_file_name, out_path)
 
         for chapter in chapters:
             self.stats.chapters += 1
-            chapter_dir = out_path
-            for parent in chapter.parent_headings:
-                chapter_dir = chapter_dir / get_valid_filename(parent)
-            chapter_dir.mkdir(parents=True, exist_ok=True)
-
-            chapter_filename = (
-                fallback_out_file_name
-                if chapter.heading is None
-                else get_valid_filename(chapter.heading.heading_title) + ".md"
-            )
-            chapter_path = chapter_dir / chapter_filename
+            chapter_path = out_path / self.get_chapter_path(chapter, fallback_out_file_name)
+            chapter_path.parent.mkdir(parents=True, exist_ok=True)
 
             if self.verbose:
                 print(f"Write {len(chapter.text)} lines to '{chapter_path}'")
@@ -96,12 +127,18 @@ class Splitter(ABC):
                     else chapter.heading.heading_title
                 )
                 if self.navigation:
-                    nav_chapter_path2title[chapter_path.relative_to(out_path)] = title
+                    # only keep a plain string per chapter, not the Path or the chapter itself
+                    nav_chapter_path2title[str(chapter_path.relative_to(out_path))] = title
                 if self.toc:
                     indent = len(chapter.parent_headings) * "  "
                     toc += f"\n{indent}- [{title}](<./{chapter_path.relative_to(out_path)}>)"
+            lines = chapter.text
+            if self.rewrite_links:
+                lines = self.anchor_index.rewrite_links(
+                    lines, doc, chapter_path.relative_to(self.out_path)
+                )
             with open(chapter_path, mode="a", encoding=self.encoding) as file:
-                for line in chapter.text:
+                for line in lines:
                     file.write(line)
 
         if self.navigation:
@@ -127,6 +164,23 @@ class Splitter(ABC):
                     print(f"Write table of contents to {out_path / 'toc.md'}")
                 file.write(toc)
 
+    def get_doc_name(self, fallback_out_file_name, out_path):
+        """Name of the input document relative to the input root (as used in links)"""
+        return (out_path.relative_to(self.out_path).parent / fallback_out_file_name).as_posix()
+
+    @staticmethod
+    def get_chapter_path(chapter, fallback_out_file_name):
+        """Path of the chapter file relative to the output folder of its input file"""
+        chapter_dir = Path()
+        for parent in chapter.parent_headings:
+            chapter_dir = chapter_dir / get_valid_filename(parent)
+        chapter_filename = (
+            fallback_out_file_name
+            if chapter.heading is None
+            else get_valid_filename(chapter.heading.heading_title) + ".md"
+        )
+        return chapter_dir / chapter_filename
+
     @staticmethod
     def remove_md_suffix(filename):
         if filename.endswith(".md"):
@@ -137,8 +191,10 @@ class Splitter(ABC):
 class StdinSplitter(Splitter):
     """Split content from stdin"""
 
-    def __init__(self, encoding, level, toc, navigation, out_path, force, verbose):
-        super().__init__(encoding, level, toc, navigation, force, verbose)
+    def __init__(
+        self, encoding, level, toc, navigation, out_path, force, verbose, rewrite_links=False
+    ):
+        super().__init__(encoding, level, toc, navigation, force, verbose, rewrite_links)
         self.out_path = Path(DIR_SUFFIX) if out_path is None else Path(out_path)
         if self.out_path.exists():
             if self.force:
@@ -147,7 +203,13 @@ class StdinSplitter(Splitter):
                 raise MdSplitError(f"Output directory '{self.out_path}' already exists. Exiting..")
 
     def process(self):
-        self.process_stream(sys.stdin, "stdin.md", self.out_path)
+        in_stream = sys.stdin
+        if self.rewrite_links:
+            # stdin can only be read once, but the anchor index must be complete
+            # before the first chapter is written
+            in_stream = sys.stdin.readlines()
+            self.index_stream(in_stream, "stdin.md", self.out_path)
+        self.process_stream(in_stream, "stdin.md", self.out_path)
 
     def print_stats(self):
         print("Splittig result (from stdin):")
@@ -158,8 +220,19 @@ class StdinSplitter(Splitter):
 class PathBasedSplitter(Splitter):
     """Split a specific file or all .md files found in a directory (recursively)"""
 
-    def __init__(self, in_path, encoding, level, toc, navigation, out_path, force, verbose):
-        super().__init__(encoding, level, toc, navigation, force, verbose)
+    def __init__(
+        self,
+        in_path,
+        encoding,
+        level,
+        toc,
+        navigation,
+        out_path,
+        force,
+        verbose,
+        rewrite_links=False,
+    ):
+        super().__init__(encoding, level, toc, navigation, force, verbose, rewrite_links)
         self.in_path = Path(in_path)
         if not self.in_path.exists():
             raise MdSplitError(f"Input file/directory '{self.in_path}' does not exist. Exiting..")
@@ -176,21 +249,32 @@ class PathBasedSplitter(Splitter):
                 raise MdSplitError(f"Output directory '{self.out_path}' already exists. Exiting..")
 
     def process(self):
+        if self.rewrite_links:
+            # links may point to headings further down or in other files,
+            # so all headings must be indexed before the first chapter is written
+            for in_file_path, out_path in self.find_files():
+                self.index_file(in_file_path, out_path)
+        for in_file_path, out_path in self.find_files():
+            self.process_file(in_file_path, out_path)
+
+    def find_files(self):
+        """Generator that returns (input file, output folder) for each file to split"""
         if self.in_path.is_file():
-            self.process_file(self.in_path, self.out_path)
-        else:
-            self.process_directory(self.in_path, Path(self.out_path))
-
-    def process_directory(self, in_dir_path, out_path):
-        for dir_path, dirs, files in os.walk(in_dir_path):
+            yield self.in_path, self.out_path
+            return
+        for dir_path, dirs, files in os.walk(self.in_path):
             for file_name in files:
                 if not Path(file_name).suffix == ".md":
                     continue
                 file_path = Path(dir_path) / file_name
                 new_out_path = (
-                    out_path / os.path.relpath(dir_path, in_dir_path) / Path(file_name).stem
+                    self.out_path / os.path.relpath(dir_path, self.in_path) / Path(file_name).stem
                 )
-                self.process_file(file_path, new_out_path)
+                yield file_path, new_out_path
+
+    def index_file(self, in_file_path, out_path):
+        with open(in_file_path, encoding=self.encoding) as stream:
+            self.index_stream(stream, in_file_path.name, out_path)
 
     def process_file(self, in_file_path, out_path):
         if self.verbose:
@@ -208,46 +292,75 @@ class PathBasedSplitter(Splitter):
 def split_by_heading(text, max_level):
     """
     Generator that returns a list of chapters from text.
-    Each chapter's text includes the heading line.
+    Each chapter's text includes the heading line(s).
+
+    Sibling chapters share the same parent headings tuple.
     """
-    curr_parent_headings = [None] * MAX_HEADING_LEVEL
-    curr_heading_line = None
+    # parent headings of a heading at a given level (index 0 is unused)
+    level2parents = [()] * (MAX_HEADING_LEVEL + 1)
+    curr_heading = None
     curr_lines = []
     within_fence = False
+    within_front_matter = False
+    paragraph = Paragraph()
     for next_line in text:
         next_line = Line(next_line)
 
-        if next_line.is_fence():
+        heading = None
+        if not curr_lines and next_line.full_line.rstrip() == FRONT_MATTER_START:
+            # may be YAML front matter, whose closing '---' is no setext underline
+            within_front_matter = True
+        elif within_front_matter and next_line.full_line.rstrip() in FRONT_MATTER_ENDS:
+            within_front_matter = False
+        elif next_line.is_fence():
             within_fence = not within_fence
+            paragraph.reset()
+        elif within_fence:
+            pass
+        elif next_line.is_heading():
+            heading = Heading(next_line.heading_level, next_line.heading_title)
+            heading_start = len(curr_lines)
+            paragraph.reset()
+        elif within_front_matter:
+            # no setext headings in (possible) front matter
+            pass
+        else:
+            setext_level = paragraph.get_setext_level(next_line)
+            if setext_level > 0:
+                # the whole paragraph above the underline is the heading
+                heading_start = paragraph.start
+                title = " ".join(line.strip() for line in curr_lines[heading_start:])
+                if not has_valid_filename(title):
+                    # e.g. '$$' followed by a thematic break
+                    setext_level = 0
+            if setext_level > 0:
+                heading = Heading(setext_level, title)
+                paragraph.reset()
+            else:
+                paragraph.update(next_line, len(curr_lines))
 
-        is_chapter_finished = (
-            not within_fence and next_line.is_heading() and next_line.heading_level <= max_level
-        )
-        if is_chapter_finished:
+        if heading is not None and heading.heading_level <= max_level:
+            heading_lines = curr_lines[heading_start:]
+            del curr_lines[heading_start:]
             if len(curr_lines) > 0:
-                parents = __get_parents(curr_parent_headings, curr_heading_line)
-                yield Chapter(parents, curr_heading_line, curr_lines)
+                yield __get_chapter(level2parents, curr_heading, curr_lines)
 
-                if curr_heading_line is not None:
-                    curr_level = curr_heading_line.heading_level
-                    curr_parent_headings[curr_level - 1] = curr_heading_line.heading_title
-                    for level in range(curr_level, MAX_HEADING_LEVEL):
-                        curr_parent_headings[level] = None
+                if curr_heading is not None:
+                    curr_level = curr_heading.heading_level
+                    child_parents = level2parents[curr_level] + (curr_heading.heading_title,)
+                    for level in range(curr_level + 1, MAX_HEADING_LEVEL + 1):
+                        level2parents[level] = child_parents
 
-            curr_heading_line = next_line
-            curr_lines = []
+            curr_heading = heading
+            curr_lines = heading_lines
 
         curr_lines.append(next_line.full_line)
-    parents = __get_parents(curr_parent_headings, curr_heading_line)
-    yield Chapter(parents, curr_heading_line, curr_lines)
+    yield __get_chapter(level2parents, curr_heading, curr_lines)
 
 
-def __get_parents(parent_headings, heading_line):
-    if heading_line is None:
-        return []
-    max_level = heading_line.heading_level
-    trunc = list(parent_headings)[: (max_level - 1)]
-    return [h for h in trunc if h is not None]
+def __get_chapter(level2parents, heading, lines):
+    parents = () if heading is None else level2parents[heading.heading_level]
+    return Chapter(parents, heading, lines)
 
 
 class Line:
@@ -262,6 +375,8 @@ class Line:
     - whitespace around title are stripped
     """
 
+    __slots__ = ("full_line", "heading_level", "heading_title")
+
     def __init__(self, line):
         self.full_line = line
         self._detect_heading(line)
@@ -269,7 +384,7 @@ class Line:
     def _detect_heading(self, line):
         self.heading_level = 0
         self.heading_title = None
-        result = re.search("^[ ]{0,3}(#+)(.*)", line)
+        result = ATX_HEADING.match(line)
         if result is not None and (len(result[1]) <= MAX_HEADING_LEVEL):
             title = result[2]
             if len(title) > 0 and not (title.startswith(" ") or title.startswith("\t")):
@@ -282,15 +397,193 @@ class Line:
             self.heading_title = title
 
     def is_fence(self):
-        for fence in FENCES:
-            if self.full_line.startswith(fence):
-                return True
-        return False
+        return self.full_line.startswith(FENCES)
 
     def is_heading(self):
         return self.heading_level > 0
 
 
+class Paragraph:
+    """
+    Track the paragraph preceding a line, which becomes a setext heading
+    if the line is a setext underline (e.g. '===' or '---').
+
+    Instead of looking ahead, the start of the paragraph is remembered as index
+    into the lines already collected for the current chapter.
+    This keeps the extra state constant, no matter how long the paragraph is.
+
+    Edge cases are handled according to commonmark, e.g.:
+    - '---' without a preceding paragraph is a thematic break
+    - paragraphs in block quotes or list items (including lazy continuation lines)
+      are not underlined, e.g. '> Foo' followed by '---' is a thematic break
+    - indented lines without a preceding paragraph are code blocks
+    - HTML blocks (lines starting with '<') are not underlined,
+      e.g. '<!-- comment -->' followed by '---' is a thematic break
+    - only bullet list items and ordered list items starting at 1 interrupt a paragraph,
+      e.g. 'Foo' followed by '2. bar' and '---' is a setext heading 'Foo 2. bar'
+    """
+
+    __slots__ = ("start", "within_list")
+
+    # the paragraph belongs to a block quote, list item or HTML block
+    NESTED = -1
+
+    def __init__(self):
+        self.start = None
+        self.within_list = False
+
+    def reset(self):
+        self.start = None
+        self.within_list = False
+
+    def get_setext_level(self, line):
+        if self.start is None or self.start == Paragraph.NESTED:
+            return 0
+        if line.full_line[:1] not in SETEXT_UNDERLINE_CHARS:
+            # fast path for most lines
+            return 0
+        result = SETEXT_UNDERLINE.match(line.full_line)
+        if result is None:
+            return 0
+        return 1 if result[1] == "=" else 2
+
+    def update(self, line, index):
+        """Update the paragraph state with a line (that is not a heading or fence)"""
+        full_line = line.full_line
+        if not full_line or full_line.isspace():
+            self.start = None
+            return
+
+        first_char = full_line[:1]
+        if first_char not in " \t":
+            self.within_list = False
+        # fast path for most lines
+        block = BLOCK_START.match(full_line) if first_char in BLOCK_START_CHARS else None
+        if block is None:
+            if self.start is not None:
+                # paragraph continuation (lazy in case of block quotes and list items)
+                return
+            if self.within_list:
+                self.start = Paragraph.NESTED
+            elif not (full_line.startswith("    ") or full_line.startswith("\t")):
+                # (otherwise an indented code block)
+                self.start = index
+        elif block[1] is not None:
+            # thematic break
+            self.start = None
+        elif block[3] is not None:
+            # block quote or HTML block (both continue until a blank line)
+            self.start = Paragraph.NESTED
+        else:
+            # list item
+            marker, is_empty = block[4], not block[5].strip()
+            is_bullet = marker in "-+*"
+            if self.start is not None and (is_empty or not (is_bullet or int(marker[:-1]) == 1)):
+                # only non-empty bullet items or ordered items starting at 1
+                # interrupt a paragraph, others are paragraph continuations
+                return
+            self.within_list = True
+            # an empty item can not contain a paragraph
+            self.start = None if is_empty else Paragraph.NESTED
+
+
+class AnchorIndex:
+    """
+    Global index of heading anchors to the chapter files the headings are written to.
+
+    Anchors are derived from heading titles like GitHub does
+    (lower case, punctuation removed, spaces replaced by dashes,
+    duplicates suffixed with -1, -2, ..).
+    Duplicates are counted per input document for the anchors used in links
+    and per chapter file for the anchors after splitting,
+    so each (document, anchor) is mapped to (chapter path, anchor in the chapter file).
+    The empty anchor of a document points to its first chapter.
+    """
+
+    def __init__(self):
+        self.anchor2target = {}
+        self.doc_anchor_counts = {}
+        self.chapter_anchor_counts = {}
+
+    def add_chapter(self, doc, heading, chapter_path):
+        """Add a chapter's heading (None for text before the first heading)"""
+        self.anchor2target.setdefault((doc, ""), (chapter_path, ""))
+        if heading is not None:
+            self.add_heading(doc, heading.heading_title, chapter_path)
+
+    def add_heading(self, doc, heading_title, chapter_path):
+        anchor = get_anchor(heading_title)
+        doc_anchor = AnchorIndex._count_anchor(self.doc_anchor_counts, doc, anchor)
+        chapter_anchor = AnchorIndex._count_anchor(self.chapter_anchor_counts, chapter_path, anchor)
+        self.anchor2target[(doc, doc_anchor)] = (chapter_path, chapter_anchor)
+
+    @staticmethod
+    def _count_anchor(anchor_counts, scope, anchor):
+        """Suffix the anchor with -1, -2, .. if it already occurred within the scope"""
+        count = anchor_counts.get((scope, anchor), 0)
+        anchor_counts[(scope, anchor)] = count + 1
+        if count > 0:
+            return f"{anchor}-{count}"
+        return anchor
+
+    def rewrite_links(self, lines, doc, chapter_path):
+        """
+        Generator that returns the lines of a chapter with links to indexed headings
+        pointing to the chapter files (relative to chapter_path).
+        Inline links and reference definitions are rewritten,
+        links inside code blocks / code spans and links to unknown anchors are left untouched.
+        """
+        chapter_dir = chapter_path.parent.as_posix()
+        within_fence = False
+        for line in lines:
+            if line.startswith(FENCES):
+                within_fence = not within_fence
+            elif not within_fence and "]" in line:
+                definition = REFERENCE_DEFINITION.match(line)
+                if definition is not None:
+                    line = (
+                        definition[1]
+                        + self._rewrite_destination(definition[2], doc, chapter_dir)
+                        + line[definition.end() :]
+                    )
+                elif "](" in line:
+                    line = LINK_DESTINATION.sub(
+                        lambda match: self._rewrite_inline_link(match, doc, chapter_dir), line
+                    )
+            yield line
+
+    def _rewrite_inline_link(self, match, doc, chapter_dir):
+        if match[1] is not None:
+            # code span
+            return match[0]
+        return "](" + self._rewrite_destination(match[2], doc, chapter_dir)
+
+    def _rewrite_destination(self, destination, doc, chapter_dir):
+        original_destination = destination
+        is_bracketed = destination.startswith("<")
+        if is_bracketed:
+            destination = destination[1:-1]
+        path, _, anchor = destination.partition("#")
+        if ":" in path or not (path or anchor):
+            # absolute URLs (http:, mailto:, ..) and empty links
+            return original_destination
+
+        target_doc = (
+            posixpath.normpath(posixpath.join(posixpath.dirname(doc), path)) if path else doc
+        )
+        target = self.anchor2target.get((target_doc, anchor))
+        if target is None:
+            return original_destination
+
+        target_path, target_anchor = target
+        new_destination = posixpath.relpath(target_path.as_posix(), chapter_dir)
+        if target_anchor:
+            new_destination += "#" + target_anchor
+        if is_bracketed or " " in new_destination:
+            new_destination = f"<{new_destination}>"
+        return new_destination
+
+
 class MdSplitError(Exception):
     """MdSplit must stop but has an explanation string to be shown to the user"""
 
@@ -313,6 +606,23 @@ def get_valid_filename(name):
     return s
 
 
+def get_anchor(heading_title):
+    """
+    Derive the anchor of a heading like GitHub does
+    """
+    s = heading_title.strip().lower()
+    s = re.sub(r"(?u)[^-\w ]", "", s)
+    return s.replace(" ", "-")
+
+
+def has_valid_filename(name):
+    try:
+        get_valid_filename(name)
+        return True
+    except ValueError:
+        return False
+
+
 def main():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__
@@ -351,6 +661,12 @@ def main():
         action="store_true",
         help="add a navigation footer on each page (links to toc, previous page, next page)",
     )
+    parser.add_argument(
+        "-r",
+        "--rewrite-links",
+        action="store_true",
+        help="rewrite links to headings so that they point to the split chapter files",
+    )
     parser.add_argument(
         "-o", "--output", default=None, help="path to output folder (must not exist)"
     )
@@ -369,6 +685,7 @@ def main():
             "level": args.max_level,
             "toc": args.table_of_contents,
             "navigation": args.navigation,
+            "rewrite_links": args.rewrite_links,
             "out_path": args.output,
             "force": args.force,
             "verbose": args.verbose,
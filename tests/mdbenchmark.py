@@ -0,0 +1,54 @@
+"""
+Measure run time, allocations and peak memory of splitting many small chapters
+
+Usage (from the repository root): python tests/mdbenchmark.py [number of chapters]
+"""
+
+from pathlib import Path
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from mdsplit import split_by_heading  # noqa: E402
+
+
+def generate_lines(chapters):
+    random.seed(42)
+    lines = []
+    for i in range(chapters):
+        lines.append("#" * random.randint(1, 6) + f" Heading {i}\n")
+        for j in range(random.randint(1, 3)):
+            lines.append(f"Line {j} of chapter {i}\n")
+    return lines
+
+
+def measure(lines, retain):
+    """Split lines, optionally retaining the chapter records (like toc/navigation would)"""
+    retained = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for chapter in split_by_heading(lines, 6):
+        if retain:
+            retained.append((chapter.parent_headings, chapter.heading))
+    duration = time.perf_counter() - start
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = snapshot.statistics("filename")
+    blocks = sum(stat.count for stat in stats)
+    size = sum(stat.size for stat in stats)
+    return duration, blocks, size, peak
+
+
+chapters = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+lines = generate_lines(chapters)
+print(f"Split {len(lines)} lines into {chapters} chapters")
+for retain in [False, True]:
+    duration, blocks, size, peak = measure(lines, retain)
+    print(
+        f"- {'retained' if retain else 'streamed'}: {duration:.2f} s, "
+        f"{blocks} blocks / {size / 1_000_000:.1f} MB still allocated, "
+        f"peak {peak / 1_000_000:.1f} MB"
+    )
@@ -1,5 +1,8 @@
+from pathlib import Path
 import pytest
 from mdsplit import Line
+from mdsplit import StdinSplitter
+from mdsplit import get_anchor
 from mdsplit import get_valid_filename
 from mdsplit import split_by_heading
 
@@ -11,6 +14,119 @@ def test_get_valid_filename():
     assert get_valid_filename("non_ascii_Äß鳥_ჩიტები") == "non_ascii_Äß鳥_ჩიტები"
 
 
+def test_get_anchor():
+    assert get_anchor("Heading 1") == "heading-1"
+    assert get_anchor("Heading 2 (dense)") == "heading-2-dense"
+    assert get_anchor("  Mixed_Case & Punctuation! ") == "mixed_case--punctuation"
+    assert get_anchor("non_ascii_Äß鳥") == "non_ascii_äß鳥"
+
+
+def build_anchor_index(doc2text, max_level=1):
+    splitter = StdinSplitter(None, max_level, False, False, "out", False, False, True)
+    for doc, text in doc2text.items():
+        out_path = splitter.out_path / Path(doc).with_suffix("")
+        splitter.index_stream(text.splitlines(keepends=True), Path(doc).name, out_path)
+    return splitter.anchor_index
+
+
+def rewrite_link(anchor_index, line, doc="doc.md", chapter_path="doc/A.md"):
+    return "".join(anchor_index.rewrite_links([line], doc, Path(chapter_path)))
+
+
+def test_anchor_index_duplicate_headings():
+    anchor_index = build_anchor_index(
+        {"doc.md": "# A\n## Details\n## Details\n# B\n## Details\n# A\n## Details\n"}
+    )
+
+    assert rewrite_link(anchor_index, "[x](#details)") == "[x](A.md#details)"
+    assert rewrite_link(anchor_index, "[x](#details-1)") == "[x](A.md#details-1)"
+    # the only 'Details' in B.md
+    assert rewrite_link(anchor_index, "[x](#details-2)") == "[x](B.md#details)"
+    # the second chapter 'A' is appended to A.md
+    assert rewrite_link(anchor_index, "[x](#a-1)") == "[x](A.md#a-1)"
+    assert rewrite_link(anchor_index, "[x](#details-3)") == "[x](A.md#details-2)"
+
+
+def test_anchor_index_rewrite_links():
+    anchor_index = build_anchor_index(
+        {
+            "doc.md": "Intro\n# A\n# B\n## B Sub\n",
+            "sub dir/other doc.md": "# Other\n",
+        }
+    )
+
+    # link to the chapter's own file
+    assert rewrite_link(anchor_index, "[x](#a)") == "[x](A.md#a)"
+    assert rewrite_link(anchor_index, "[x](#b-sub) [y](#b)") == "[x](B.md#b-sub) [y](B.md#b)"
+    # the empty anchor points to the first chapter
+    assert rewrite_link(anchor_index, "[x](<sub dir/other doc.md>)") == (
+        "[x](<../sub dir/other doc/Other.md>)"
+    )
+    assert rewrite_link(anchor_index, "[x](<sub dir/other doc.md#other>)") == (
+        "[x](<../sub dir/other doc/Other.md#other>)"
+    )
+    line = rewrite_link(
+        anchor_index, "[x](../doc.md)", "sub dir/other doc.md", "sub dir/other doc/Other.md"
+    )
+    assert line == "[x](../../doc/doc.md)"
+    assert rewrite_link(anchor_index, "[x](#unknown)") == "[x](#unknown)"
+    assert rewrite_link(anchor_index, "[x](mailto:a@b.c)") == "[x](mailto:a@b.c)"
+    assert rewrite_link(anchor_index, "[x](http://doc.md#a)") == "[x](http://doc.md#a)"
+    assert rewrite_link(anchor_index, "[x]()") == "[x]()"
+
+
+@pytest.mark.parametrize(
+    "max_level, anchor2destination",
+    [
+        (1, {"pre": "doc.md", "a": "A.md", "sub": "A.md", "deep": "A.md", "setext": "A.md"}),
+        (
+            2,
+            {
+                "pre": "Pre.md",
+                "a": "A.md",
+                "sub": "A/Sub.md",
+                "deep": "A/Sub.md",
+                "setext": "A/Setext.md",
+            },
+        ),
+        (
+            3,
+            {
+                "pre": "Pre.md",
+                "a": "A.md",
+                "sub": "A/Sub.md",
+                "deep": "A/Sub/Deep.md",
+                "setext": "A/Setext.md",
+            },
+        ),
+    ],
+)
+def test_anchor_index_headings_below_split_level(max_level, anchor2destination):
+    anchor_index = build_anchor_index(
+        {"doc.md": "## Pre\n# A\n## Sub\n### Deep\nSetext\n---\n"}, max_level
+    )
+
+    for anchor, destination in anchor2destination.items():
+        line = rewrite_link(anchor_index, f"[x](#{anchor})", chapter_path="doc/A.md")
+        assert line == f"[x]({destination}#{anchor})"
+
+
+def test_anchor_index_rewrite_links_skips_code_spans():
+    anchor_index = build_anchor_index({"doc.md": "# A\n# B\n"})
+
+    assert rewrite_link(anchor_index, "`[x](#b)` [y](#b)") == "`[x](#b)` [y](B.md#b)"
+    assert rewrite_link(anchor_index, "``a ` [x](#b)`` [y](#b)") == "``a ` [x](#b)`` [y](B.md#b)"
+
+
+def test_anchor_index_rewrite_reference_definitions():
+    anchor_index = build_anchor_index({"doc.md": "# A\n# B\n"})
+
+    assert rewrite_link(anchor_index, '[r]: #b "Title"\n') == '[r]: B.md#b "Title"\n'
+    assert rewrite_link(anchor_index, "   [r]:  <#b>\n") == "   [r]:  <B.md#b>\n"
+    assert rewrite_link(anchor_index, "[r]: #unknown\n") == "[r]: #unknown\n"
+    assert rewrite_link(anchor_index, "    [r]: #b\n") == "    [r]: #b\n"
+
+
 def test_line():
     line = Line("~~~")
     assert line.is_fence()
@@ -68,11 +184,11 @@ def test_split_by_heading_simple(max_level):
 
     assert chapters[0].heading.heading_title == "Heading 1"
     assert chapters[0].heading.heading_level == 1
-    assert chapters[0].parent_headings == []
+    assert chapters[0].parent_headings == ()
     assert len(chapters[0].text) == 7
     assert chapters[1].heading.heading_title == "Heading 2"
     assert chapters[1].heading.heading_level == 1
-    assert chapters[1].parent_headings == []
+    assert chapters[1].parent_headings == ()
     assert len(chapters[1].text) == 3
 
 
@@ -81,11 +197,13 @@ def test_split_by_heading_jump():
         chapters = list(split_by_heading(fh, 6))
 
     assert len(chapters) == 8
-    assert chapters[1].parent_headings == ["1"]
-    assert chapters[2].parent_headings == ["1"]
-    assert chapters[3].parent_headings == ["1"]
-    assert chapters[4].parent_headings == ["1", "1.4"]
-    assert chapters[5].parent_headings == ["1"]
+    assert chapters[1].parent_headings == ("1",)
+    assert chapters[2].parent_headings == ("1",)
+    assert chapters[3].parent_headings == ("1",)
+    assert chapters[4].parent_headings == ("1", "1.4")
+    assert chapters[5].parent_headings == ("1",)
+    # siblings share the same parent headings
+    assert chapters[1].parent_headings is chapters[2].parent_headings
 
 
 @pytest.mark.parametrize("max_level", range(1, 7))
@@ -121,15 +239,118 @@ def test_split_by_h3_nested():
 
     assert chapters[1].heading.heading_title == "Heading 1.1"
     assert chapters[1].heading.heading_level == 2
-    assert chapters[1].parent_headings == ["Heading 1"]
+    assert chapters[1].parent_headings == ("Heading 1",)
     assert len(chapters[1].text) == 6
 
     assert chapters[2].heading.heading_title == "Heading 1.2"
     assert chapters[2].heading.heading_level == 2
-    assert chapters[2].parent_headings == ["Heading 1"]
+    assert chapters[2].parent_headings == ("Heading 1",)
     assert len(chapters[2].text) == 3
 
     assert chapters[9].heading.heading_title == "Heading 3.1.1"
     assert chapters[9].heading.heading_level == 3
-    assert chapters[9].parent_headings == ["Heading 3 (deeply nested)", "Heading 3.1"]
+    assert chapters[9].parent_headings == ("Heading 3 (deeply nested)", "Heading 3.1")
     assert len(chapters[9].text) == 22
+
+
+def test_split_by_h1_setext():
+    with open("tests/test_resources/setext.md") as fh:
+        chapters = list(split_by_heading(fh, 1))
+
+    assert len(chapters) == 3
+
+    assert chapters[0].heading.heading_title == "Setext Heading 1"
+    assert chapters[0].heading.heading_level == 1
+    assert len(chapters[0].text) == 23
+    assert chapters[1].heading.heading_title == "Setext Heading 2 spanning multiple lines"
+    assert chapters[1].heading.heading_level == 1
+    assert chapters[1].text[0] == "Setext Heading 2\n"
+    assert len(chapters[1].text) == 4
+    assert chapters[2].heading.heading_title == "ATX Heading 3"
+
+
+def test_split_by_h2_setext():
+    with open("tests/test_resources/setext.md") as fh:
+        chapters = list(split_by_heading(fh, 2))
+
+    assert len(chapters) == 4
+
+    assert chapters[1].heading.heading_title == "Setext Heading 1.1"
+    assert chapters[1].heading.heading_level == 2
+    assert chapters[1].parent_headings == ("Setext Heading 1",)
+    assert len(chapters[1].text) == 18
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Text\n\n---\n",  # thematic break
+        "===\n",  # paragraph
+        "> Foo\n---\n",  # block quote followed by thematic break
+        "> Foo\nbar\n===\n",  # lazy continuation line
+        "- Foo\n---\n",  # list item followed by thematic break
+        "- Foo\n\n  bar\n  ---\n",  # setext heading in list item
+        "```\nFoo\n---\n```\n",  # code block
+        "    Foo\n---\n",  # indented code block
+        "Foo\n= =\n",  # not an underline
+        "Foo\n1. bar\n---\n",  # ordered list starting at 1 interrupts the paragraph
+        "Foo\n- bar\n---\n",  # bullet list interrupts the paragraph
+        "<!-- comment -->\n---\n",  # HTML block followed by thematic break
+        "<div>\nhi\n</div>\n---\n",  # HTML block followed by thematic break
+        "Intro\n\n$$\n---\n",  # no valid file name can be derived from the title
+    ],
+)
+def test_split_by_heading_no_setext(text):
+    chapters = list(split_by_heading(text.splitlines(keepends=True), 6))
+
+    assert len(chapters) == 1
+    assert chapters[0].heading is None
+
+
+@pytest.mark.parametrize("lines", [["Foo\n", ""], ["", "Foo"], [""]])
+def test_split_by_heading_empty_lines(lines):
+    chapters = list(split_by_heading(lines, 6))
+
+    assert len(chapters) == 1
+    assert chapters[0].text == lines
+
+
+@pytest.mark.parametrize("end", ["---\n", "...\n"])
+def test_split_by_heading_front_matter(end):
+    text = ["---\n", "title: x\n", end, "\n", "Foo\n", "---\n", "Text\n"]
+    chapters = list(split_by_heading(text, 6))
+
+    assert len(chapters) == 2
+    assert chapters[0].heading is None
+    assert chapters[0].text == text[:4]
+    assert chapters[1].heading.heading_title == "Foo"
+    assert chapters[1].heading.heading_level == 2
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "---\n# A\ntext\n# B\nmore\n",  # no closing line
+        "---\n# A\ntext\n---\n# B\nmore\n",  # slide-style
+    ],
+)
+def test_split_by_heading_leading_thematic_break(text):
+    chapters = list(split_by_heading(text.splitlines(keepends=True), 6))
+
+    assert [c.heading.heading_title if c.heading else None for c in chapters] == [None, "A", "B"]
+    assert "".join("".join(c.text) for c in chapters) == text
+
+
+@pytest.mark.parametrize(
+    "text, title",
+    [
+        ("Foo\n2. bar\n---\n", "Foo 2. bar"),  # ordered list not starting at 1
+        ("Foo\n*\n---\n", "Foo *"),  # empty list item
+    ],
+)
+def test_split_by_heading_setext_list_marker_continuation(text, title):
+    chapters = list(split_by_heading(text.splitlines(keepends=True), 6))
+
+    assert len(chapters) == 1
+    assert chapters[0].heading.heading_title == title
+    assert chapters[0].heading.heading_level == 2
@@ -52,9 +52,9 @@ def test_default_h1_split(tmp_path, script_runner):
 
     # is there a way to access the Stats object?
     # that would be more elegant than comparing stdout
-    assert "- 8 input file(s)" in ret.stdout
-    assert "- 17 extracted chapter(s)" in ret.stdout
-    assert "- 23 new output file(s)" in ret.stdout
+    assert "- 9 input file(s)" in ret.stdout
+    assert "- 20 extracted chapter(s)" in ret.stdout
+    assert "- 27 new output file(s)" in ret.stdout
 
 
 def test_default_h1_split_with_navigation(tmp_path, script_runner):
@@ -73,9 +73,9 @@ def test_default_h1_split_with_navigation(tmp_path, script_runner):
     assert_same_file_list(tmp_path, "tests/test_expected/by_h1_with_navigation")
     assert_same_file_contents(tmp_path, "tests/test_expected/by_h1_with_navigation")
 
-    assert "- 8 input file(s)" in ret.stdout
-    assert "- 17 extracted chapter(s)" in ret.stdout
-    assert "- 23 new output file(s)" in ret.stdout
+    assert "- 9 input file(s)" in ret.stdout
+    assert "- 20 extracted chapter(s)" in ret.stdout
+    assert "- 27 new output file(s)" in ret.stdout
 
 
 def test_default_h1_split_with_navigation_without_toc(tmp_path, script_runner):
@@ -149,4 +149,21 @@ def test_encoding(tmp_path, script_runner):
     pass
 
 
+def test_rewrite_links(tmp_path, script_runner):
+    ret = script_runner.run(
+        [
+            "mdsplit.py",
+            "tests/test_resources_links",
+            "--output",
+            str(tmp_path),
+            "--table-of-contents",
+            "--rewrite-links",
+            "--force",
+        ]
+    )
+    assert ret.success
+    assert_same_file_list(tmp_path, "tests/test_expected/links")
+    assert_same_file_contents(tmp_path, "tests/test_expected/links")
+
+
 # TODO how could we test stdin handling?